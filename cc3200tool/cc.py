@@ -19,14 +19,19 @@
 
 import sys
 import os
+import stat
+import io
+import shutil
 import time
 import argparse
 import struct
-import math
+import mmap
 import logging
 from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from pkgutil import get_data
-from collections import namedtuple
+from collections import namedtuple, deque
 import json
 
 import serial
@@ -58,6 +63,31 @@ OPCODE_GET_STORAGE_INFO = b'\x31'
 OPCODE_EXEC_FROM_RAM = b'\x32'
 OPCODE_SWITCH_2_APPS = b'\x33'
 
+# precompiled codecs for the packet framing and frequently built commands
+_PACKET_HDR = struct.Struct(">HB")                 # length, checksum
+_RAW_WRITE_HDR = struct.Struct(">3xcIII")          # (framing), opcode, storage, offset, size
+_STORAGE_CMD = struct.Struct(">III")               # storage, offset/start, size/count
+_STORAGE_INFO = struct.Struct(">HH")               # block size, block count
+_VERSION_INFO = struct.Struct("20B")               # bootloader, nwp, mac, phy, chip type
+_FILE_INFO = struct.Struct(">B3xI")                # exists flag, size
+_U32 = struct.Struct(">I")
+_U32_PAIR = struct.Struct(">II")                   # flags/offset, reserved/size
+_SFFS_HDR = struct.Struct("<HH")                   # FAT commit revision, signature
+_SFFS_FAT_ENTRY = struct.Struct("<I")              # index, size, start LSB, flags/start MSB
+_SFFS_FNAME_ENTRY = struct.Struct("<HH")           # file name offset, length
+_SFFS_FILE_HDR = struct.Struct("<I")               # 24 bit file size, first magic byte
+
+# constant parts of the finish upload command
+_FINISH_UPLOAD_PAD = b'\x00' * 63
+_DEFAULT_SIGNATURE = b'\x46' * 256
+
+# the 16 bit packet length field covers the payload plus 2 bytes framing
+MAX_PACKET_PAYLOAD = 0xffff - 2
+# opcode, storage id, offset and size precede the raw write data
+MAX_RAW_WRITE_CHUNK = MAX_PACKET_PAYLOAD - 13
+# opcode and file offset precede the file upload data
+MAX_FILE_CHUNK_SIZE = MAX_PACKET_PAYLOAD - 5
+
 STORAGE_ID_SRAM = 0x0
 STORAGE_ID_SFLASH = 0x2
 
@@ -88,11 +118,39 @@ SLFS_MODE_OPEN_WRITE = 1
 SLFS_MODE_OPEN_CREATE = 2
 SLFS_MODE_OPEN_WRITE_CREATE_IF_NOT_EXIST = 3
 
+# a progress dot is printed every _PROGRESS_STRIDE chunks
+_PROGRESS_STRIDE = 64
+
 
 def hexify(s):
     return " ".join([hex(x) for x in s])
 
 
+def checksum(data):
+    return sum(data) & 0xff
+
+
+def encode_filename(filename):
+    """target file names may be passed as str or as already encoded bytes"""
+    return filename if isinstance(filename, bytes) else filename.encode()
+
+
+def decode_filename(filename):
+    return filename.decode() if isinstance(filename, bytes) else filename
+
+
+def progress(count):
+    if count % _PROGRESS_STRIDE == 0 and log.isEnabledFor(logging.INFO):
+        sys.stderr.write('.')
+        sys.stderr.flush()
+
+
+def progress_done(count):
+    """end the line of progress dots, if progress() printed any"""
+    if count >= _PROGRESS_STRIDE and log.isEnabledFor(logging.INFO):
+        sys.stderr.write("\n")
+
+
 Pincfg = namedtuple('Pincfg', ['invert', 'pin'])
 
 
@@ -113,6 +171,18 @@ def pinarg(extra=None):
     return _parse
 
 
+def sizearg(maximum=None):
+    def _parse(x):
+        size = auto_int(x)
+        if maximum is None and size < 1:
+            raise argparse.ArgumentTypeError(f"{x} is not a positive number")
+        if maximum is not None and not 1 <= size <= maximum:
+            raise argparse.ArgumentTypeError(f"{x} not within 1..{maximum}")
+        return size
+
+    return _parse
+
+
 def auto_int(x):
     return int(x, 0)
 
@@ -195,6 +265,20 @@ parser.add_argument(
 parser.add_argument(
         "--erase_timeout", type=auto_int, default=ERASE_TIMEOUT,
         help="Specify block erase timeout for all operations which involve block erasing")
+parser.add_argument(
+        "--chunk-size", type=sizearg(MAX_RAW_WRITE_CHUNK), default=None,
+        help="Payload size of raw storage write packets (default is 4080 bytes)")
+parser.add_argument(
+        "--write-window", type=sizearg(), default=1,
+        help="Number of raw storage write packets sent ahead of their ACK (default is 1)")
+parser.add_argument(
+        "--file-chunk-size", type=sizearg(MAX_FILE_CHUNK_SIZE), default=None,
+        help="Payload size of file upload packets (default is 4096 bytes)")
+parser.add_argument(
+        "--read-window", type=sizearg(), default=1,
+        help="EXPERIMENTAL: Number of raw storage read requests in flight (default is 1). "
+             "With more than 1, the ACK of a reply is sent after the following requests, "
+             "bootloaders waiting for that ACK before the next command lose sync")
 parser.add_argument(
         "--reboot-to-app", action="store_true",
         help="When finished, reboot to the application")
@@ -298,10 +382,56 @@ parser_write_all_files.add_argument(
         "--simulate", action="store_false",
         help="List all files to be written and skip writing them")
 
+@lru_cache(maxsize=None)
 def dll_data(fname):
+    # the packaged blobs never change, each is read once per process
     return get_data('cc3200tool', os.path.join('dll', fname))
 
 
+def open_local_file(path):
+    """open a local file for reading and let the kernel read it ahead"""
+    f = open(path, 'rb')
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+    return f
+
+
+@contextmanager
+def local_file_data(local_file):
+    """contents of an opened local file, regular files are mapped instead of read"""
+    try:
+        st = os.fstat(local_file.fileno())
+    except (AttributeError, OSError):
+        st = None
+    if (st is None or not stat.S_ISREG(st.st_mode) or not st.st_size
+            or local_file.tell() != 0):
+        yield local_file.read()
+        return
+
+    data = mmap.mmap(local_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield data
+    finally:
+        try:
+            data.close()
+        except BufferError:
+            # a traceback still references chunks of it, leave it to the gc
+            pass
+
+
+def store_local_file(path, data, created_dirs):
+    """write data to a local file, creating its directory unless in created_dirs"""
+    target_dir = os.path.dirname(path)
+    if target_dir not in created_dirs:
+        os.makedirs(name=target_dir, exist_ok=True)
+        created_dirs.add(target_dir)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
 class CC3200Error(Exception):
     pass
 
@@ -320,12 +450,8 @@ class CC3x00VersionInfo(object):
 
     @classmethod
     def from_packet(cls, data):
-        bootloader = tuple(data[0:4])
-        nwp = tuple(data[4:8])
-        mac = tuple(data[8:12])
-        phy = tuple(data[12:16])
-        chip_type = tuple(data[16:20])
-        return cls(bootloader, nwp, mac, phy, chip_type)
+        vals = _VERSION_INFO.unpack_from(data)
+        return cls(vals[0:4], vals[4:8], vals[8:12], vals[12:16], vals[16:20])
 
     def __repr__(self):
         return "CC3x00VersionInfo({}, {}, {}, {}, {})".format(
@@ -363,7 +489,7 @@ class CC3x00StorageInfo(object):
 
     @classmethod
     def from_packet(cls, data):
-        bsize, bcount = struct.unpack(">HH", data[:4])
+        bsize, bcount = _STORAGE_INFO.unpack_from(data)
         return cls(bsize, bcount)
 
     def __repr__(self):
@@ -391,12 +517,14 @@ class CC3x00FileInfo(object):
 
     @classmethod
     def from_packet(cls, data):
-        exists = data[0] == 0x01
-        size = struct.unpack(">I", data[4:8])[0]
-        return cls(exists, size)
+        exists, size = _FILE_INFO.unpack_from(data)
+        return cls(exists == 0x01, size)
 
 
 class CC3x00SffsStatsFileEntry(object):
+    __slots__ = ('index', 'start_block', 'size_blocks', 'mirrored', 'flags',
+                 'fname', 'total_blocks', 'header', 'magic', 'size')
+
     def __init__(self, index, start_block, size_blocks, mirrored, flags, fname, header=None):
         self.index = index
         self.start_block = start_block
@@ -417,13 +545,26 @@ class CC3x00SffsStatsFileEntry(object):
             
     def read_header(self, header):
         self.header = header
-        self.size = header[2]<<16 | header[1]<<8 | header[0]<<0 
+        self.size = _SFFS_FILE_HDR.unpack_from(header)[0] & 0xffffff
         self.magic = bytearray(header[3:])
         
     def get_magic(self):
         ##fileheader[6:7] 4c 53
         return ''.join('{:02x}'.format(x) for x in self.magic)
-        
+
+    def to_dict(self):
+        return {
+            'index': self.index,
+            'start_block': self.start_block,
+            'size_blocks': self.size_blocks,
+            'mirrored': self.mirrored,
+            'flags': self.flags,
+            'fname': self.fname,
+            'total_blocks': self.total_blocks,
+            'header': None if self.header is None else bytes(self.header).hex(),
+            'magic': None if self.magic is None else self.get_magic(),
+            'size': self.size,
+        }
 
 
 class CC3x00SffsHole(object):
@@ -431,6 +572,9 @@ class CC3x00SffsHole(object):
         self.start_block = start_block
         self.size_blocks = size_blocks
 
+    def to_dict(self):
+        return {'start_block': self.start_block, 'size_blocks': self.size_blocks}
+
 
 class CC3x00SffsHeader(object):
     SFFS_HEADER_SIGNATURE = 0x534c
@@ -448,7 +592,7 @@ class CC3x00SffsHeader(object):
         complete parsing
         """
 
-        fat_commit_revision, header_sign = struct.unpack("<HH", fat_bytes[:4])
+        fat_commit_revision, header_sign = _SFFS_HDR.unpack_from(fat_bytes)
 
         if fat_commit_revision == 0xffff or header_sign == 0xffff:
             # empty FAT
@@ -490,15 +634,19 @@ class CC3x00SffsInfo(object):
         TI's doc: "Total number of files is limited to 128 files, including
         system and configuration files"
         """
-        for i in range(128):
-            # scan the complete FAT table (as it appears to be)
-            meta = fat_header.fat_bytes[(i + 1) * 4:(i + 2) * 4]
-
-            if meta == b"\xff\xff\xff\xff" or meta == struct.pack("BBBB", 0xff, i, 0xff, 0x7f):
-                # empty entry in the middle of the FAT table
-                continue
-
-            index, size_blocks, start_block_lsb, flags_sb_msb = struct.unpack("BBBB", meta)
+        # scan the complete FAT table (as it appears to be), parsing all
+        # entries and their file name descriptors in one go and skipping
+        # the empty entries in the middle of the FAT table right away
+        fat_entries = _SFFS_FAT_ENTRY.iter_unpack(fat_header.fat_bytes[4:4 + 128 * 4])
+        meta2_entries = _SFFS_FNAME_ENTRY.iter_unpack(meta2[:128 * 4])
+        # each entry is read as a single little endian word, the empty
+        # patterns are the bytes ff ff ff ff and ff <i> ff 7f
+        live_entries = [(i, meta, meta2_e)
+                        for i, ((meta,), meta2_e) in enumerate(zip(fat_entries, meta2_entries))
+                        if meta != 0xffffffff and meta != 0x7fff00ff | (i << 8)]
+
+        for i, meta, meta2_e in live_entries:
+            index = meta & 0xff
             if index != i:
                 raise CC3200Error("incorrect FAT entry (index %d != %d)" % (index, i))
 
@@ -517,14 +665,15 @@ class CC3x00SffsInfo(object):
                 max size of 16 MB using 4K blocks
             """
 
-            flags = flags_sb_msb >> 4
-            start_block_msb = flags_sb_msb & 0xf
+            # byte 1 is the size, byte 2 and the low nibble of byte 3 the
+            # start block, the high nibble of byte 3 holds the flags
+            size_blocks = (meta >> 8) & 0xff
+            start_block = (meta >> 16) & 0xfff
+            flags = meta >> 28
 
             mirrored = (flags & 0x4) == 0
-            start_block = (start_block_msb << 8) + start_block_lsb
 
-            meta2_e = meta2[i * 4 : (i + 1) * 4]
-            fname_offset, fname_len = struct.unpack("<HH", meta2_e)
+            fname_offset, fname_len = meta2_e
             fo_abs = file_name_array_offset + fname_offset
             fname = meta2[fo_abs:fo_abs + fname_len]
 
@@ -544,8 +693,8 @@ class CC3x00SffsInfo(object):
         for snippet in occupied_block_snippets:
             if snippet[0] < prev_end_block:
                 for f in self.files:
-                    log.info("[%d] block %d..%d fname=%s" %
-                             (f.index, f.start_block, f.start_block + f.total_blocks, f.fname))
+                    log.info("[%d] block %d..%d fname=%s",
+                             f.index, f.start_block, f.start_block + f.total_blocks, f.fname)
                 raise CC3200Error("broken FAT: overlapping entry at block %d (prev end was %d)" %
                                   (snippet[0], prev_end_block))
             if snippet[0] > prev_end_block:
@@ -553,6 +702,19 @@ class CC3x00SffsInfo(object):
                 self.holes.append(hole)
             prev_end_block = snippet[0] + snippet[1]
 
+        # lookup tables for find_file(), the first entry wins on duplicates
+        self._by_name = {}
+        self._by_index = {}
+        for f in self.files:
+            self._by_name.setdefault(f.fname, f)
+            self._by_index.setdefault(f.index, f)
+
+    def find_file(self, fname, file_id=-1):
+        """look up a file entry by name, or by its FAT index if file_id is given"""
+        if file_id == -1:
+            return self._by_name.get(fname)
+        return self._by_index.get(file_id)
+
     def print_sffs_info(self, extended=False):
         log.info("Serial Flash block size:\t%d bytes", self.block_size)
         log.info("Serial Flash capacity:\t%d blocks", self.block_count)
@@ -569,17 +731,19 @@ class CC3x00SffsInfo(object):
             log.info("----------------------------------------------------------------------------")
             log.info("\tN/A\t0\t5\tN/A\tN/A\t5\tFATFS")
             
-        for f in self.files:
-            if extended:
-                log.info("\t%d\t%d\t%d\t%d\t%s\t0x%x\t%d\t%s\t%s" %
-                        (f.index, f.start_block, f.size_blocks, f.size,
-                        f.mirrored and "yes" or "no",
-                        f.flags, f.total_blocks, f.get_magic(), f.fname))
-            else:
-                log.info("\t%d\t%d\t%d\t%s\t0x%x\t%d\t%s" %
-                        (f.index, f.start_block, f.size_blocks,
-                        f.mirrored and "yes" or "no",
-                        f.flags, f.total_blocks, f.fname))
+        # skip building the per-file arguments if the lines won't be emitted
+        if log.isEnabledFor(logging.INFO):
+            for f in self.files:
+                if extended:
+                    log.info("\t%d\t%d\t%d\t%d\t%s\t0x%x\t%d\t%s\t%s",
+                             f.index, f.start_block, f.size_blocks, f.size,
+                             f.mirrored and "yes" or "no",
+                             f.flags, f.total_blocks, f.get_magic(), f.fname)
+                else:
+                    log.info("\t%d\t%d\t%d\t%s\t0x%x\t%d\t%s",
+                             f.index, f.start_block, f.size_blocks,
+                             f.mirrored and "yes" or "no",
+                             f.flags, f.total_blocks, f.fname)
 
         log.info("")
         log.info("   Flash usage")
@@ -597,13 +761,23 @@ class CC3x00SffsInfo(object):
                  self.fat_commit_revision, len(self.files), self.used_blocks,
                  self.block_count - self.used_blocks)
 
+    def to_dict(self):
+        return {
+            'fat_commit_revision': self.fat_commit_revision,
+            'block_size': self.block_size,
+            'block_count': self.block_count,
+            'used_blocks': self.used_blocks,
+            'files': [f.to_dict() for f in self.files],
+            'holes': [h.to_dict() for h in self.holes],
+        }
+
     def print_sffs_info_json(self):
-        print(json.dumps(self, cls=CustomJsonEncoder))
+        print(json.dumps(self.to_dict(), separators=(',', ':')))
 
 
 class CustomJsonEncoder(json.JSONEncoder):
     def default(self, o):
-        return o.__dict__
+        return o.to_dict()
 
 
 class CC3200Connection(object):
@@ -616,16 +790,58 @@ class CC3200Connection(object):
     TIMEOUT = 5
     DEFAULT_SLFS_SIZE = "1M"
 
-    def __init__(self, port, reset=None, sop2=None, erase_timeout=ERASE_TIMEOUT, device=None, image_file=None, output_file=None):
+    # payload of a single OPCODE_RAW_STORAGE_WRITE packet, the complete
+    # packet (3 bytes framing + 13 bytes command) fits into 4096 bytes
+    RAW_WRITE_CHUNK = 4080
+
+    # payload of a single OPCODE_FILE_CHUNK packet
+    FILE_CHUNK_SIZE = SLFS_BLOCK_SIZE
+
+    # contiguous writes to the output image file are merged up to this size
+    OUTPUT_WRITEBACK_SIZE = 0x100000
+
+    def __init__(self, port, reset=None, sop2=None, erase_timeout=ERASE_TIMEOUT, device=None, image_file=None, output_file=None, raw_write_chunk=None, write_window=1, read_window=1, file_chunk_size=None):
         self.port = port
         if not self.port is None:
             port.timeout = self.TIMEOUT
+            # reads are bounded by the overall timeout only
+            port.inter_byte_timeout = None
+            try:
+                # larger driver buffers avoid RX stalls on bursts (Windows only)
+                port.set_buffer_size(rx_size=0x10000, tx_size=0x10000)
+            except AttributeError:
+                pass
+            self._set_low_latency()
         self._device = device
         self._reset = reset
         self._sop2 = sop2
         self._erase_timeout = erase_timeout
+        if raw_write_chunk is not None:
+            if not 1 <= raw_write_chunk <= MAX_RAW_WRITE_CHUNK:
+                raise CC3200Error("invalid raw write chunk size %d" % raw_write_chunk)
+            self.RAW_WRITE_CHUNK = raw_write_chunk
+        if file_chunk_size is not None:
+            if not 1 <= file_chunk_size <= MAX_FILE_CHUNK_SIZE:
+                raise CC3200Error("invalid file chunk size %d" % file_chunk_size)
+            self.FILE_CHUNK_SIZE = file_chunk_size
+        if write_window < 1:
+            raise CC3200Error("invalid write window %d" % write_window)
+        self._write_window = write_window
+        if read_window < 1:
+            raise CC3200Error("invalid read window %d" % read_window)
+        self._read_window = read_window
+        # storage topology of the bootloader currently talked to
+        self._storage_list_cache = None
+        self._storage_info_cache = {}
+        # reused for every raw write packet, see _send_chunk()
+        self._tx_frame = bytearray(_RAW_WRITE_HDR.size + self.RAW_WRITE_CHUNK)
+        # opcodes of the packets sent without waiting for their ACK yet
+        self._pending_acks = deque()
         self._image_file = None
         self._output_file = None
+        # pending contiguous output file writes, see flush_output_file()
+        self._wb_offset = 0
+        self._wb_buf = bytearray()
         
         self.vinfo = None
         self.vinfo_apps = None
@@ -635,13 +851,51 @@ class CC3200Connection(object):
         if not output_file is None:
             self._output_file = open(output_file, 'w+b')
 
+    def flush_output_file(self):
+        """write out the chunks merged by _send_chunk to the output image file"""
+        if self._wb_buf:
+            self._output_file.seek(self._wb_offset)
+            self._output_file.write(self._wb_buf)
+            self._wb_buf = bytearray()
+
     def copy_input_file_to_output_file(self):
-        if not self._image_file is None or not self._output_file is None:
-            self._image_file.seek(0)
-            data = self._image_file.read()
+        if not self._image_file is None and not self._output_file is None:
+            self.flush_output_file()
             self._output_file.seek(0)
-            self._output_file.write(data)
+            try:
+                # let the kernel copy the image, without a userspace buffer
+                in_fd = self._image_file.fileno()
+                out_fd = self._output_file.fileno()
+                size = os.fstat(in_fd).st_size
+                copied = 0
+                while copied < size:
+                    sent = os.sendfile(out_fd, in_fd, copied, size - copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+            except (AttributeError, OSError):
+                self._image_file.seek(0)
+                self._output_file.seek(0)
+                shutil.copyfileobj(self._image_file, self._output_file, 1 << 20)
     
+    def _set_low_latency(self):
+        """
+        FTDI adapters deliver received data in 16 ms intervals by
+        default, which dominates the ACK round-trip of every packet.
+        Lower the latency timer where the driver allows to (Linux only,
+        requires write access to sysfs).
+        """
+        port_name = getattr(self.port, 'port', None)
+        if not port_name or not sys.platform.startswith('linux'):
+            return
+        tty = os.path.basename(os.path.realpath(port_name))
+        latency_file = os.path.join('/sys/bus/usb-serial/devices', tty, 'latency_timer')
+        try:
+            with open(latency_file, 'w') as f:
+                f.write('1')
+        except OSError as e:
+            log.debug("could not set latency timer of %s: %s", tty, e)
+
     @contextmanager
     def _serial_timeout(self, timeout=None):
         if timeout is None:
@@ -689,51 +943,91 @@ class CC3200Connection(object):
             self.port.rts = not in_reset
 
     def _read_ack(self, timeout=None):
-        ack_bytes = []
         with self._serial_timeout(timeout) as port:
-            while True:
-                b = port.read(1)
+            # both ACK bytes are fetched with one read, only when they don't
+            # match, the stream is scanned byte by byte to resync on the ACK
+            ack_bytes = port.read(2)
+            while ack_bytes != b'\x00\xCC':
+                b = port.read(1) if len(ack_bytes) == 2 else b''
                 if not b:
                     log.error("timed out while waiting for ack")
                     return False
-                ack_bytes.append(b)
-                if len(ack_bytes) > 2:
-                    ack_bytes.pop(0)
-                if ack_bytes == [b'\x00', b'\xCC']:
-                    return True
+                ack_bytes = ack_bytes[1:] + b
+            return True
 
-    def _read_packet(self, timeout=None):
+    def _read_packet(self, timeout=None, into=None):
+        """
+        read a packet and ACK it, if given, the payload is received directly
+        into the writable buffer `into` when it matches the payload size
+        """
         with self._serial_timeout(timeout) as port:
             header = port.read(3)
             if len(header) != 3:
                 raise CC3200Error("read_packed timed out on header")
-            len_bytes = header[:2]
-            csum_byte = header[2]
+            packet_len, csum_byte = _PACKET_HDR.unpack(header)
+
+        data_len = packet_len - 2
+        if into is None or len(into) != data_len:
+            # unexpected sizes are still received completely, to stay in
+            # sync with the target, and left to the caller to check
+            data = bytearray(data_len)
+        else:
+            data = into
 
-        data_len = struct.unpack(">H", len_bytes)[0] - 2
         with self._serial_timeout(timeout):
-            data = self.port.read(data_len)
+            received = self.port.readinto(data)
 
-        if (len(data) != data_len):
+        if (received != data_len):
             raise CC3200Error("did not get entire response")
 
-        ccsum = sum(data)
-        ccsum = ccsum & 0xff
-        if ccsum != csum_byte:
+        if checksum(data) != csum_byte:
             raise CC3200Error("rx csum failed")
 
         self._send_ack()
         return data
 
+    def _write_frame(self, frame, csum):
+        """
+        fill in the 3 bytes header of the packet in frame[3:] and send it,
+        csum is the checksum of the packet data, as computed by the caller
+        """
+        assert len(frame) > 3
+        _PACKET_HDR.pack_into(frame, 0, len(frame) - 1, csum)
+        self.port.write(frame)
+
+    def _write_packet(self, *parts):
+        """frame and send the concatenation of parts, copying each part once"""
+        frame = bytearray(3 + sum(len(p) for p in parts))
+        pos = 3
+        for p in parts:
+            frame[pos:pos + len(p)] = p
+            pos += len(p)
+        # summed over the parts, the frame is not read back again
+        self._write_frame(frame, sum(map(checksum, parts)) & 0xff)
+
     def _send_packet(self, data, timeout=None):
-        assert len(data)
-        checksum = sum(data)
-        len_blob = struct.pack(">H", len(data) + 2)
-        csum = struct.pack("B", checksum & 0xff)
-        self.port.write(len_blob + csum + data)
+        self._send_packet_parts(data, timeout=timeout)
+
+    def _send_packet_parts(self, *parts, timeout=None):
+        # keep request/response ordering, collect outstanding ACKs first
+        self._flush_pending_acks()
+        self._write_packet(*parts)
         if not self._read_ack(timeout):
             raise CC3200Error(
-                    f"No ack for packet opcode=0x{data[0]:02x}")
+                    f"No ack for packet opcode=0x{parts[0][0]:02x}")
+
+    def _send_frame_nowait(self, frame, csum):
+        """send a packet framed by the caller, but leave its ACK to _flush_pending_acks()"""
+        self._write_frame(frame, csum)
+        self._pending_acks.append(frame[3])
+
+    def _flush_pending_acks(self, keep=0):
+        """wait for the ACKs of all but the last `keep` pending packets"""
+        while len(self._pending_acks) > keep:
+            opcode = self._pending_acks.popleft()
+            if not self._read_ack():
+                raise CC3200Error(
+                        f"No ack for packet opcode=0x{opcode:02x}")
 
     def _send_ack(self):
         self.port.write(b'\x00\xCC')
@@ -770,7 +1064,17 @@ class CC3200Connection(object):
 
         return CC3x00VersionInfo((0,4,1,2), (0,0,0,0), (0,0,0,0), (0,0,0,0), (16,0,0,0))
 
+    def _invalidate_storage_cache(self):
+        """forget the storage list/info, e.g. after switching bootloaders"""
+        self._storage_list_cache = None
+        self._storage_info_cache = {}
+
     def _get_storage_list(self):
+        if self._storage_list_cache is None:
+            self._storage_list_cache = self._query_storage_list()
+        return self._storage_list_cache
+
+    def _query_storage_list(self):
         log.info("Getting storage list...")
         if not self.port is None:
             self._send_packet(OPCODE_GET_STORAGE_LIST)
@@ -783,10 +1087,15 @@ class CC3200Connection(object):
         return CC3x00StorageList(15)
 
     def _get_storage_info(self, storage_id=STORAGE_ID_SRAM):
+        if storage_id not in self._storage_info_cache:
+            self._storage_info_cache[storage_id] = self._query_storage_info(storage_id)
+        return self._storage_info_cache[storage_id]
+
+    def _query_storage_info(self, storage_id):
         log.info("Getting storage info...")
         if not self.port is None:
             self._send_packet(OPCODE_GET_STORAGE_INFO +
-                              struct.pack(">I", storage_id))
+                              _U32.pack(storage_id))
             sinfo = self._read_packet()
             if len(sinfo) < 4:
                 raise CC3200Error(f"getting storage info got {len(sinfo)} bytes")
@@ -797,18 +1106,34 @@ class CC3200Connection(object):
         return CC3x00StorageInfo(SLFS_BLOCK_SIZE, 1024) #TODO: as parameter
 
     def _erase_blocks(self, start, count, storage_id=STORAGE_ID_SRAM):
-        command = OPCODE_RAW_STORAGE_ERASE + \
-            struct.pack(">III", storage_id, start, count)
-        self._send_packet(command, timeout=self._erase_timeout)
+        self._send_packet_parts(OPCODE_RAW_STORAGE_ERASE,
+                                _STORAGE_CMD.pack(storage_id, start, count),
+                                timeout=self._erase_timeout)
 
     def _send_chunk(self, offset, data, storage_id=STORAGE_ID_SRAM):
         if not self.port is None:
-            command = OPCODE_RAW_STORAGE_WRITE + \
-                struct.pack(">III", storage_id, offset, len(data))
-            self._send_packet(command + data)
+            # framing, opcode, command header and payload in a single buffer,
+            # which is fully written out before it is reused
+            frame_len = _RAW_WRITE_HDR.size + len(data)
+            if len(self._tx_frame) < frame_len:
+                self._tx_frame = bytearray(frame_len)
+            frame = memoryview(self._tx_frame)[:frame_len]
+            _RAW_WRITE_HDR.pack_into(frame, 0, OPCODE_RAW_STORAGE_WRITE,
+                                     storage_id, offset, len(data))
+            frame[_RAW_WRITE_HDR.size:] = data
+            csum = checksum(frame[3:_RAW_WRITE_HDR.size]) + checksum(data)
+            self._send_frame_nowait(frame, csum & 0xff)
+            self._flush_pending_acks(keep=self._write_window - 1)
             return
-        self._output_file.seek(offset)
-        self._output_file.write(data)
+
+        # merge sequential chunks into one write to the output image file
+        if self._wb_buf and offset != self._wb_offset + len(self._wb_buf):
+            self.flush_output_file()
+        if not self._wb_buf:
+            self._wb_offset = offset
+        self._wb_buf += data
+        if len(self._wb_buf) >= self.OUTPUT_WRITEBACK_SIZE:
+            self.flush_output_file()
 
     def _raw_write(self, offset, data, storage_id=STORAGE_ID_SRAM):
         slist = self._get_storage_list()
@@ -817,34 +1142,64 @@ class CC3200Connection(object):
         if storage_id == STORAGE_ID_SRAM and not slist.sram:
             raise CC3200Error("no sram?!")
 
-        chunk_size = 4080
-        sent = 0
-        while sent < len(data):
-            chunk = data[sent:sent + chunk_size]
-            self._send_chunk(offset + sent, chunk, storage_id)
-            sent += len(chunk)
+        chunk_size = self.RAW_WRITE_CHUNK
+        # slicing a memoryview does not copy the chunk
+        with memoryview(data) as view:
+            for pos in range(0, len(view), chunk_size):
+                self._send_chunk(offset + pos, view[pos:pos + chunk_size], storage_id)
+        self._flush_pending_acks()
+        # nothing written stays buffered, should a later command fail
+        self.flush_output_file()
 
     def _raw_write_file(self, offset, filename, storage_id=STORAGE_ID_SRAM):
-        with open(filename, 'r') as f:
-            data = f.read()
-            return self._raw_write(offset, data, storage_id)
-
-    def _read_chunk(self, offset, size, storage_id=STORAGE_ID_SRAM):
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # empty files can't be mapped
+                return self._raw_write(offset, b'', storage_id)
+            # map the file instead of reading it, chunks are sliced from the mapping
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return self._raw_write(offset, data, storage_id)
+
+    def _submit_chunk(self, offset, size, storage_id=STORAGE_ID_SRAM):
+        """request a chunk, its ACK and data are received by _collect_chunk()"""
         if not self.port is None:
             # log.info("Reading chunk at 0x%x size 0x%x..." % (offset, size))
-            command = OPCODE_RAW_STORAGE_READ + \
-                struct.pack(">III", storage_id, offset, size)
-            self._send_packet(command)
-            data = self._read_packet()
+            self._flush_pending_acks()
+            self._write_packet(OPCODE_RAW_STORAGE_READ,
+                               _STORAGE_CMD.pack(storage_id, offset, size))
+
+    def _collect_chunk(self, offset, size, into=None):
+        if not self.port is None:
+            if not self._read_ack():
+                raise CC3200Error(
+                        f"No ack for packet opcode=0x{OPCODE_RAW_STORAGE_READ[0]:02x}")
+            data = self._read_packet(into=into)
             if len(data) != size:
                 raise CC3200Error("invalid received size: %d vs %d" % (len(data), size))
             return data
         
         self._image_file.seek(offset)
+        if into is not None:
+            # short at the end of the image file
+            return into[:self._image_file.readinto(into)]
         data = self._image_file.read(size)
         return data
 
+    def _read_chunk(self, offset, size, storage_id=STORAGE_ID_SRAM, into=None):
+        self._submit_chunk(offset, size, storage_id)
+        return self._collect_chunk(offset, size, into)
+
     def _raw_read(self, offset, size, storage_id=STORAGE_ID_SRAM, sinfo=None):
+        rx_data = bytearray()
+        self._raw_read_into(offset, size, rx_data, storage_id, sinfo)
+        return rx_data
+
+    def _raw_read_into(self, offset, size, sink, storage_id=STORAGE_ID_SRAM, sinfo=None):
+        """
+        read a storage range into sink, which is either a bytearray (resized
+        to the data read) or a file-like object each chunk is written to,
+        returns the number of bytes read
+        """
         slist = self._get_storage_list()
         if storage_id == STORAGE_ID_SFLASH and not slist.sflash:
             raise CC3200Error("no serial flash?!")
@@ -871,47 +1226,83 @@ class CC3200Connection(object):
 
         # XXX 4096 works faster, but 256 was sniffed from the uniflash
         chunk_size = 4096
-        rx_data = b''
-        while size - len(rx_data) > 0:
-            rx_data += self._read_chunk(offset + len(rx_data),
-                                        min(chunk_size, size - len(rx_data)),
-                                        storage_id)
-            sys.stderr.write('.')
-            sys.stderr.flush()
-        sys.stderr.write("\n")
-        return rx_data
+        # keep up to read_window requests in flight, their replies are
+        # collected in order. Note that the host ACK of a reply then goes
+        # out after the requests sent in the meantime, a bootloader which
+        # waits for that ACK before reading the next command gets out of
+        # sync, so this stays opt-in (experimental)
+        window = 1 if self.port is None else self._read_window
+
+        # chunks are received in place when reading into memory, otherwise
+        # into one buffer slot per request in flight and passed on right away
+        in_place = isinstance(sink, bytearray)
+        if in_place:
+            # grown chunk by chunk, without a zero filled copy of the whole size
+            zeros = bytes(chunk_size)
+            while len(sink) < size:
+                sink += zeros[:size - len(sink)]
+            rx_view = memoryview(sink)
+        else:
+            rx_view = memoryview(bytearray(chunk_size * window))
+
+        in_flight = deque()
+        submitted = pos = chunks = 0
+        while pos < size:
+            while submitted < size and len(in_flight) < window:
+                n = min(chunk_size, size - submitted)
+                self._submit_chunk(offset + submitted, n, storage_id)
+                in_flight.append((submitted, n))
+                submitted += n
+
+            start, n = in_flight.popleft()
+            if in_place:
+                into = rx_view[start:start + n]
+            else:
+                slot = (start // chunk_size) % window * chunk_size
+                into = rx_view[slot:slot + n]
+            data = self._collect_chunk(offset + start, n, into=into)
+            if not in_place:
+                sink.write(data)
+            received = len(data)
+            pos += received
+            chunks += 1
+            progress(chunks)
+            if received < n:
+                # image file ends before the requested range
+                break
+        progress_done(chunks)
+        # drop the views, so that the sink can be resized
+        data = into = None
+        rx_view.release()
+        if in_place:
+            del sink[pos:]
+        return pos
 
     def _exec_from_ram(self):
         self._send_packet(OPCODE_EXEC_FROM_RAM)
 
     def _get_file_info(self, filename, file_id=-1):
         if not self.port is None and file_id == -1:
-            command = OPCODE_GET_FILE_INFO \
-                + struct.pack(">I", len(filename)) \
-                + filename.encode()
-            self._send_packet(command)
+            encoded = encode_filename(filename)
+            self._send_packet_parts(OPCODE_GET_FILE_INFO,
+                                    _U32.pack(len(encoded)),
+                                    encoded)
             finfo = self._read_packet()
             if len(finfo) < 5:
                 raise CC3200Error()
             return CC3x00FileInfo.from_packet(finfo)
         
         fat_info = self.get_fat_info(inactive=False)
-        finfo = CC3x00FileInfo(exists=False, size=0)
-        for file in fat_info.files:
-            if file_id == -1:
-                if file.fname == filename:
-                    finfo = CC3x00FileInfo(exists=True, size=file.size_blocks*SLFS_BLOCK_SIZE)
-                    break
-            elif file.index == file_id:
-                finfo = CC3x00FileInfo(exists=True, size=file.size_blocks*SLFS_BLOCK_SIZE)
-                break
-        return finfo
+        file = fat_info.find_file(decode_filename(filename), file_id)
+        if file is None:
+            return CC3x00FileInfo(exists=False, size=0)
+        return CC3x00FileInfo(exists=True, size=file.size_blocks*SLFS_BLOCK_SIZE)
     
 
     def _open_file_for_write(self, filename, file_len, fs_flags=None):
         for bsize_idx, bsize in enumerate(FLASH_BLOCK_SIZES):
             if (bsize * 255) >= file_len:
-                blocks = int(math.ceil(float(file_len) / bsize))
+                blocks = -(-file_len // bsize)
                 break
         else:
             raise CC3200Error("file is too big")
@@ -930,9 +1321,8 @@ class CC3200Connection(object):
         return self._open_file(filename, 0)
 
     def _open_file(self, filename, slfs_flags):
-        command = OPCODE_START_UPLOAD + struct.pack(">II", slfs_flags, 0) + \
-            filename.encode() + b'\x00\x00'
-        self._send_packet(command)
+        self._send_packet_parts(OPCODE_START_UPLOAD, _U32_PAIR.pack(slfs_flags, 0),
+                                encode_filename(filename), b'\x00\x00')
 
         token = self.port.read(4)
         if not len(token) == 4:
@@ -940,21 +1330,19 @@ class CC3200Connection(object):
 
     def _close_file(self, signature=None):
         if signature is None:
-            signature = b'\x46' * 256
+            signature = _DEFAULT_SIGNATURE
         if len(signature) != 256:
             raise CC3200Error("bad signature length")
-        command = OPCODE_FINISH_UPLOAD
-        command += b'\x00' * 63
-        command += signature
-        command += b'\x00'
-        self._send_packet(command)
+        self._send_packet_parts(OPCODE_FINISH_UPLOAD, _FINISH_UPLOAD_PAD,
+                                signature, b'\x00')
         s = self._get_last_status()
         if not s.is_ok:
             raise CC3200Error("closing file failed")
 
     def connect(self):
         log.info("Connecting to target...")
-        self.port.flushInput()
+        self._invalidate_storage_cache()
+        self.port.reset_input_buffer()
         self._do_reset(True)
         self._try_breaking(tries=5, timeout=2)
         log.info("Connected, reading version...")
@@ -989,6 +1377,8 @@ class CC3200Connection(object):
             log.info("Uploading rbtl3100s.dll...")
             self._raw_write(0, dll_data('rbtl3100s.dll'))
             self._exec_from_ram()
+            # from here on the NWP bootloader answers
+            self._invalidate_storage_cache()
 
         if not self._read_ack():
             raise CC3200Error("got no ACK after exec from ram")
@@ -1001,6 +1391,7 @@ class CC3200Connection(object):
         log.info("Resetting communications ...")
         time.sleep(1)
         self._try_breaking()
+        self._invalidate_storage_cache()
         self.vinfo_apps = self._get_version()
 
     def format_slfs(self, size=None):
@@ -1017,6 +1408,7 @@ class CC3200Connection(object):
             + struct.pack(">IIIII", 2, size//4, 0, 0, 2)
 
         self._send_packet(command)
+        self._invalidate_storage_cache()
 
         s = self._get_last_status()
         if not s.is_ok:
@@ -1026,55 +1418,48 @@ class CC3200Connection(object):
         if not force:
             finfo = self._get_file_info(filename)
             if not finfo.exists:
-                log.warn("File '%s' does not exist, won't erase", filename)
+                log.warn("File '%s' does not exist, won't erase", decode_filename(filename))
                 return
 
-        log.info("Erasing file %s...", filename)
-        command = OPCODE_ERASE_FILE + struct.pack(">I", 0) + \
-            filename.encode() + b'\x00'
-        self._send_packet(command)
+        log.info("Erasing file %s...", decode_filename(filename))
+        self._send_packet_parts(OPCODE_ERASE_FILE, _U32.pack(0),
+                                encode_filename(filename), b'\x00')
         s = self._get_last_status()
         if not s.is_ok:
             raise CC3200Error(f"Erasing file failed: 0x{s.value:02x}")
 
-    def write_file(self, local_file, cc_filename, file_id=-1, sign_file=None, size=0, commit_flag=False, use_api=True):
-        # size must be known in advance, so read the whole thing
-        file_data = local_file.read()
-        file_len = len(file_data)
+    def write_file(self, local_file, cc_filename, file_id=-1, sign_file=None, size=0, commit_flag=False, use_api=True, fat_info=None):
+        # size must be known in advance, so map or read the whole thing
+        with local_file_data(local_file) as file_data:
+            file_len = len(file_data)
 
-        if not file_len:
-            log.warn("Won't upload empty file")
-            return
+            if not file_len:
+                log.warn("Won't upload empty file")
+                return
 
-        sign_data = None
-        fs_flags = None
+            sign_data = None
+            fs_flags = None
 
-        if commit_flag:
-            fs_flags = SLFS_FILE_OPEN_FLAG_COMMIT
+            if commit_flag:
+                fs_flags = SLFS_FILE_OPEN_FLAG_COMMIT
 
-        if sign_file:
-            sign_data = sign_file.read(256)
-            fs_flags = (
-                    SLFS_FILE_OPEN_FLAG_COMMIT |
-                    SLFS_FILE_OPEN_FLAG_SECURE |
-                    SLFS_FILE_PUBLIC_WRITE)
+            if sign_file:
+                sign_data = sign_file.read(256)
+                fs_flags = (
+                        SLFS_FILE_OPEN_FLAG_COMMIT |
+                        SLFS_FILE_OPEN_FLAG_SECURE |
+                        SLFS_FILE_PUBLIC_WRITE)
             
-        if use_api == False:
-            return self._write_file_raw(local_file, cc_filename, file_id, sign_data, fs_flags, size, file_data, file_len)
-        else:
-            return self._write_file_api(local_file, cc_filename, sign_data, fs_flags, size, file_data, file_len)
+            if use_api == False:
+                return self._write_file_raw(local_file, cc_filename, file_id, sign_data, fs_flags, size, file_data, file_len, fat_info)
+            else:
+                return self._write_file_api(local_file, cc_filename, sign_data, fs_flags, size, file_data, file_len)
             
-    def _write_file_raw(self, local_file, cc_filename, file_id, sign_data, fs_flags, size, file_data, file_len):
-        fat_info = self.get_fat_info(inactive=False, extended=True)
-        filefinfo = None
-        for file in fat_info.files:
-            if file_id == -1:
-                if file.fname == cc_filename:
-                    filefinfo = file
-                    break
-            elif file.index == file_id:
-                filefinfo = file
-                break
+    def _write_file_raw(self, local_file, cc_filename, file_id, sign_data, fs_flags, size, file_data, file_len, fat_info=None):
+        # an extended FAT info may be passed in by callers writing several files
+        if fat_info is None:
+            fat_info = self.get_fat_info(inactive=False, extended=True)
+        filefinfo = fat_info.find_file(cc_filename, file_id)
         
         if filefinfo == None:
             log.info("File not found, only overwriting is supported.")
@@ -1082,7 +1467,7 @@ class CC3200Connection(object):
         
         #TODO: commit_flag --> Mirror
         alloc_size_effective = alloc_size = max(size, file_len) + self.SFFS_FAT_FILE_HEADER_SIZE
-        blocks = int(alloc_size/fat_info.block_size+1) 
+        blocks = alloc_size // fat_info.block_size + 1 
         if (fs_flags and fs_flags & SLFS_FILE_OPEN_FLAG_COMMIT):
             alloc_size_effective *= 2
         
@@ -1097,20 +1482,22 @@ class CC3200Connection(object):
             raise CC3200Error(f"File header in flash is missing or has the wrong size")
         
         fatfs_offset = filefinfo.start_block*fat_info.block_size
-        header = list(filefinfo.header)
+        header_new = bytearray(filefinfo.header)
         #TODO: Use old filesize, so space stays reserved
-        header[2] = (file_len>>16) & 0xFF
-        header[1] = (file_len>>8) & 0xFF
-        header[0] = (file_len>>0) & 0xFF
-        header_new = bytearray(header)
+        # the file size is stored as 24 bit little endian value
+        header_new[0:3] = struct.pack("<I", file_len)[:3]
         self._raw_write(fatfs_offset, header_new, storage_id=STORAGE_ID_SFLASH)
         self._raw_write(self.SFFS_FAT_FILE_HEADER_SIZE+fatfs_offset, file_data, storage_id=STORAGE_ID_SFLASH)
+        # the FAT itself is untouched, keep the entry in sync with the new header
+        filefinfo.read_header(header_new)
                 
     def _write_file_api(self, local_file, cc_filename, sign_data, fs_flags, size, file_data, file_len):
-        finfo = self._get_file_info(cc_filename)
+        # the name is encoded once for all commands below
+        encoded = encode_filename(cc_filename)
+        finfo = self._get_file_info(encoded)
         if finfo.exists:
             log.info("File exists on target, erasing")
-            self.erase_file(cc_filename)
+            self.erase_file(encoded, force=True)
 
         alloc_size_effective = alloc_size = max(size, file_len)
 
@@ -1125,22 +1512,22 @@ class CC3200Connection(object):
                  local_file.name, cc_filename, alloc_size, alloc_size_effective)
 
         with self._serial_timeout(timeout):
-            self._open_file_for_write(cc_filename, alloc_size, fs_flags)
-
-        pos = 0
-        while pos < file_len:
-            chunk = file_data[pos:pos+SLFS_BLOCK_SIZE]
-            command = OPCODE_FILE_CHUNK + struct.pack(">I", pos)
-            command += chunk
-            self._send_packet(command)
-            res = self._get_last_status()
-            if not res.is_ok:
-                raise CC3200Error(f"writing at pos {pos} failed")
-            pos += len(chunk)
-            sys.stderr.write('.')
-            sys.stderr.flush()
-
-        sys.stderr.write("\n")
+            self._open_file_for_write(encoded, alloc_size, fs_flags)
+
+        # slicing a memoryview does not copy the chunk
+        with memoryview(file_data) as file_view:
+            pos = chunks = 0
+            while pos < file_len:
+                chunk = file_view[pos:pos+self.FILE_CHUNK_SIZE]
+                self._send_packet_parts(OPCODE_FILE_CHUNK, _U32.pack(pos), chunk)
+                res = self._get_last_status()
+                if not res.is_ok:
+                    raise CC3200Error(f"writing at pos {pos} failed")
+                pos += len(chunk)
+                chunks += 1
+                progress(chunks)
+
+        progress_done(chunks)
         log.debug("Closing file ...")
         return self._close_file(sign_data)
 
@@ -1154,12 +1541,13 @@ class CC3200Connection(object):
         if not self.port is None and file_id == -1:
             self._open_file_for_read(cc_fname)
 
+            # all chunks are received into the same buffer
+            rx_buf = memoryview(bytearray(SLFS_BLOCK_SIZE))
             pos = 0
             while pos < finfo.size:
                 toread = min(finfo.size - pos, SLFS_BLOCK_SIZE)
-                command = OPCODE_READ_FILE_CHUNK + struct.pack(">II", pos, toread)
-                self._send_packet(command)
-                resp = self._read_packet()
+                self._send_packet_parts(OPCODE_READ_FILE_CHUNK, _U32_PAIR.pack(pos, toread))
+                resp = self._read_packet(into=rx_buf[:toread])
                 if len(resp) != toread:
                     raise CC3200Error("reading chunk failed")
 
@@ -1170,34 +1558,30 @@ class CC3200Connection(object):
             return
         
         fat_info = self.get_fat_info(inactive=False, extended=True)
-        filefinfo = None
-        for file in fat_info.files:
-            if file_id == -1:
-                if file.fname == cc_fname:
-                    filefinfo = file
-                    break
-            elif file.index == file_id:
-                filefinfo = file
-                break
+        filefinfo = fat_info.find_file(cc_fname, file_id)
             
         sinfo = self._get_storage_info(storage_id=STORAGE_ID_SFLASH)
         fatfs_offset = filefinfo.start_block*fat_info.block_size        
-        data = self._raw_read(self.SFFS_FAT_FILE_HEADER_SIZE+fatfs_offset, filefinfo.size, storage_id=STORAGE_ID_SFLASH, sinfo=sinfo)
-        local_file.write(data) 
+        self._raw_read_into(self.SFFS_FAT_FILE_HEADER_SIZE+fatfs_offset, filefinfo.size, local_file, storage_id=STORAGE_ID_SFLASH, sinfo=sinfo)
 
     def write_flash(self, image, erase=True):
         data = image.read()
         data_len = len(data)
         if erase:
-            count = int(math.ceil(data_len / float(SLFS_BLOCK_SIZE)))
+            count = -(-data_len // SLFS_BLOCK_SIZE)
             self._erase_blocks(0, count, storage_id=STORAGE_ID_SFLASH)
 
-        self._raw_write(8, data[8:], storage_id=STORAGE_ID_SFLASH)
-        self._raw_write(0, data[:8], storage_id=STORAGE_ID_SFLASH)
+        # the first 8 bytes go last, they fit into a single chunk which is
+        # sent right after the rest of the image, storage checks were done
+        # by the first write
+        with memoryview(data) as view:
+            self._raw_write(8, view[8:], storage_id=STORAGE_ID_SFLASH)
+            self._send_chunk(0, view[:8], storage_id=STORAGE_ID_SFLASH)
+        self._flush_pending_acks()
+        self.flush_output_file()
 
     def read_flash(self, image_file, offset, size):
-        data = self._raw_read(offset, size, storage_id=STORAGE_ID_SFLASH)
-        image_file.write(data)
+        self._raw_read_into(offset, size, image_file, storage_id=STORAGE_ID_SFLASH)
 
     def get_fat_info(self, inactive=False, extended=False):
         metadata2_offset = self.SFFS_FAT_METADATA2_CC3200_OFFSET
@@ -1277,37 +1661,75 @@ class CC3200Connection(object):
     def read_all_files(self, local_dir, by_file_id=False):
         fat_info = self.get_fat_info(inactive=False)
         fat_info.print_sffs_info()
-        for f in fat_info.files:
-            ccname = f.fname
-            if by_file_id and f.fname == '':
-                ccname = str(f.index)
-                                
-            if ccname.startswith('/'):
-                ccname = ccname[1:]
-            target_file = os.path.join(local_dir, ccname) 
-            if not os.path.exists(os.path.dirname(target_file)):
-                os.makedirs(name=os.path.dirname(target_file))
-
-            try:
+        created_dirs = set()
+
+        def wait_store(pending):
+            if pending is not None:
+                f, store = pending
+                try:
+                    store.result()
+                except Exception as ex:
+                    log.error("File %s could not be stored, %s" % (f.fname, str (ex)))
+
+        # files are read into memory and stored by a worker thread, so the
+        # local disk I/O overlaps with reading the next file from the target,
+        # at most one store is outstanding
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending = None
+            for f in fat_info.files:
+                ccname = f.fname
                 if by_file_id and f.fname == '':
-                    self.read_file(ccname, open(target_file, 'wb', -1), f.index)
-                else:
-                    self.read_file(f.fname, open(target_file, 'wb', -1))
-            except Exception as ex:
-                log.error("File %s could not be read, %s" % (f.fname, str (ex)))
+                    ccname = str(f.index)
+                                    
+                if ccname.startswith('/'):
+                    ccname = ccname[1:]
+                target_file = os.path.join(local_dir, ccname) 
+
+                local_file = io.BytesIO()
+                local_file.name = target_file
+                try:
+                    if by_file_id and f.fname == '':
+                        self.read_file(ccname, local_file, f.index)
+                    else:
+                        self.read_file(f.fname, local_file)
+                except Exception as ex:
+                    log.error("File %s could not be read, %s" % (f.fname, str (ex)))
+                    continue
+
+                wait_store(pending)
+                pending = (f, writer.submit(store_local_file, target_file,
+                                            local_file.getbuffer(), created_dirs))
+            wait_store(pending)
 
     def write_all_files(self, local_dir, write=True, use_api=True):
-        for root, dirs, files in os.walk(local_dir):
-            for file in files:
-                filepath = os.path.join(root, file)
+        # raw writes only touch file headers and contents, so the FAT is read once
+        fat_info = None
+        if write and not use_api:
+            fat_info = self.get_fat_info(inactive=False, extended=True)
+
+        # the next file is opened ahead, so that the kernel reads it in while
+        # the current one is uploaded
+        filepaths = [os.path.join(root, file)
+                     for root, dirs, files in os.walk(local_dir) for file in files]
+        next_file = None
+        try:
+            for i, filepath in enumerate(filepaths):
                 ccpath = filepath[len(local_dir):]
                 if not ccpath.startswith("/"):
                     ccpath = "/" + ccpath
 
                 if write:
-                    self.write_file(local_file=open(filepath, 'rb', -1), cc_filename=ccpath, use_api=use_api)
+                    local_file = next_file or open_local_file(filepath)
+                    next_file = None
+                    with local_file:
+                        if i + 1 < len(filepaths):
+                            next_file = open_local_file(filepaths[i + 1])
+                        self.write_file(local_file=local_file, cc_filename=ccpath, use_api=use_api, fat_info=fat_info)
                 else:
                     log.info("Simulation: Would copy local file %s to cc3200 %s" % (filepath, ccpath))
+        finally:
+            if next_file is not None:
+                next_file.close()
 
 
 def split_argv(cmdline_args):
@@ -1354,7 +1776,7 @@ def main():
     port_name = args.port
 
     if not args.image_file is None:
-        cc = CC3200Connection(None, reset_method, sop2_method, erase_timeout=args.erase_timeout, device=args.device, image_file=args.image_file, output_file=args.output_file)
+        cc = CC3200Connection(None, reset_method, sop2_method, erase_timeout=args.erase_timeout, device=args.device, image_file=args.image_file, output_file=args.output_file, raw_write_chunk=args.chunk_size, write_window=args.write_window, read_window=args.read_window, file_chunk_size=args.file_chunk_size)
     
     else:
         try:
@@ -1365,7 +1787,7 @@ def main():
             log.warn("unable to open serial port %s: %s", port_name, e)
             sys.exit(-2)
 
-        cc = CC3200Connection(p, reset_method, sop2_method, erase_timeout=args.erase_timeout)
+        cc = CC3200Connection(p, reset_method, sop2_method, erase_timeout=args.erase_timeout, raw_write_chunk=args.chunk_size, write_window=args.write_window, read_window=args.read_window, file_chunk_size=args.file_chunk_size)
         try:
             cc.connect()
             log.info("connected to target")